@@ -30,7 +30,9 @@
 
 from RNS.Interfaces.Interface import Interface
 from RNS.Interfaces.BackboneInterface import BackboneInterface
-import socketserver
+import selectors
+import struct
+import heapq
 import threading
 import socket
 import time
@@ -43,26 +45,222 @@ class HDLC():
     FLAG              = 0x7E
     ESC               = 0x7D
     ESC_MASK          = 0x20
+    FLAG_BYTES        = bytes([FLAG])
+    ESC_BYTES         = bytes([ESC])
+    ESCAPED_FLAG      = bytes([ESC, FLAG^ESC_MASK])
+    ESCAPED_ESC       = bytes([ESC, ESC^ESC_MASK])
+
+    # Escaping and unescaping is done with the C-level bytes
+    # methods, which run at native speed regardless of how
+    # dense the special bytes are. Pure Python byte loops are
+    # one to two orders of magnitude slower than this.
 
     @staticmethod
     def escape(data):
-        data = data.replace(bytes([HDLC.ESC]), bytes([HDLC.ESC, HDLC.ESC^HDLC.ESC_MASK]))
-        data = data.replace(bytes([HDLC.FLAG]), bytes([HDLC.ESC, HDLC.FLAG^HDLC.ESC_MASK]))
+        # For payloads without special bytes, both passes
+        # return the original object without copying it.
+        data = data.replace(HDLC.ESC_BYTES, HDLC.ESCAPED_ESC)
+        data = data.replace(HDLC.FLAG_BYTES, HDLC.ESCAPED_FLAG)
         return data
 
-class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    def server_bind(self):
-        if RNS.vendor.platformutils.is_windows():
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
-        else:
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind(self.server_address)
-        self.server_address = self.socket.getsockname()
+    @staticmethod
+    def unescape(data, start=0, end=None):
+        # Copies data[start:end] out in a single slice, and
+        # only unescapes it if it contains escape sequences.
+        if end == None: end = len(data)
+        with memoryview(data) as view: frame = bytes(view[start:end])
+        if data.find(HDLC.ESC, start, end) == -1: return frame
+
+        frame = frame.replace(HDLC.ESCAPED_FLAG, HDLC.FLAG_BYTES)
+        frame = frame.replace(HDLC.ESCAPED_ESC, HDLC.ESC_BYTES)
+        return frame
+
+class LocalReactor():
+    # Services all local interface sockets from a single thread
+    # on platforms without the epoll backend, instead of running
+    # one thread per socket. Like with the epoll backend, the
+    # sockets are non-blocking, and data the kernel can not take
+    # right away stays in the transmit buffer of the interface
+    # until its socket becomes writable again, so a client that
+    # stops reading never stalls the reactor thread.
+    selector    = None
+    wakeup      = None
+    timers      = []
+    timer_count = 0
+    _job_active = False
+    _job_lock   = threading.Lock()
+    _timer_lock = threading.Lock()
+
+    @staticmethod
+    def start():
+        if not LocalReactor._job_active: threading.Thread(target=LocalReactor.__job, daemon=True).start()
+
+    @staticmethod
+    def ensure_selector():
+        with LocalReactor._job_lock:
+            if not LocalReactor.selector:
+                LocalReactor.selector = selectors.DefaultSelector()
+                LocalReactor.wakeup = socket.socketpair()
+                LocalReactor.wakeup[0].setblocking(False)
+                LocalReactor.selector.register(LocalReactor.wakeup[0], selectors.EVENT_READ, (LocalReactor.drain_wakeup, None))
+
+    @staticmethod
+    def register(sock, read_callback, write_callback=None):
+        sock.setblocking(False)
+        LocalReactor.ensure_selector()
+        LocalReactor.selector.register(sock, selectors.EVENT_READ, (read_callback, write_callback))
+        LocalReactor.start()
+        LocalReactor.wake()
+
+    @staticmethod
+    def wake():
+        # Interrupt any select call in progress, so selectors
+        # that only pick up changes on their next call will
+        # start servicing them immediately.
+        try: LocalReactor.wakeup[1].send(b"\x00")
+        except Exception as e: RNS.log(f"Error while waking local interface reactor: {e}", RNS.LOG_DEBUG)
+
+    @staticmethod
+    def set_writable(sock, writable):
+        # Sockets are only watched for writability while they
+        # have buffered data left, since they would otherwise
+        # be reported as ready on every pass.
+        if writable: events = selectors.EVENT_READ | selectors.EVENT_WRITE
+        else:        events = selectors.EVENT_READ
+
+        try:
+            key = LocalReactor.selector.get_key(sock)
+            LocalReactor.selector.modify(sock, events, key.data)
+        except Exception as e: RNS.log(f"Error while updating socket in local interface reactor: {e}", RNS.LOG_DEBUG)
+
+        if writable: LocalReactor.wake()
+
+    @staticmethod
+    def schedule(deadline, callback):
+        # Runs the callback on the reactor thread once the
+        # monotonic clock has reached the deadline.
+        with LocalReactor._timer_lock:
+            LocalReactor.timer_count += 1
+            heapq.heappush(LocalReactor.timers, (deadline, LocalReactor.timer_count, callback))
+
+        LocalReactor.ensure_selector()
+        LocalReactor.start()
+        LocalReactor.wake()
+
+    @staticmethod
+    def add_listener(interface, bind_address):
+        # Listeners are serviced by the reactor thread too, so
+        # accepting a client does not spawn a thread for it.
+        # SO_REUSEPORT is deliberately not used, since a failed
+        # bind is how a second instance detects that a shared
+        # instance is already running.
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if RNS.vendor.platformutils.is_windows(): server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:                                     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        try:
+            server_socket.bind(bind_address)
+            server_socket.listen(socket.SOMAXCONN)
+
+        except Exception as e:
+            server_socket.close()
+            raise e
+
+        def accept_ready():
+            try: client_socket, address = server_socket.accept()
+            except (BlockingIOError, InterruptedError): return
+            except Exception as e:
+                RNS.log(f"Accepting socket failed for incoming connection on {interface}: {e}", RNS.LOG_WARNING)
+                return
+
+            try:
+                if not interface.incoming_connection(client_socket): client_socket.close()
+
+            except Exception as e:
+                RNS.log(f"Error while handling incoming connection on {interface}: {e}", RNS.LOG_ERROR)
+                try: client_socket.close()
+                except Exception as e: RNS.log(f"Error while closing socket for failed incoming connection: {e}", RNS.LOG_WARNING)
+
+        LocalReactor.register(server_socket, accept_ready)
+        return server_socket
+
+    @staticmethod
+    def deregister(sock):
+        if LocalReactor.selector:
+            try: LocalReactor.selector.unregister(sock)
+            except Exception as e: RNS.log(f"Error while deregistering socket from local interface reactor: {e}", RNS.LOG_DEBUG)
+
+    @staticmethod
+    def drain_wakeup():
+        try:
+            while LocalReactor.wakeup[0].recv(4096): pass
+        except BlockingIOError: pass
+
+    @staticmethod
+    def run_timers():
+        now = time.monotonic()
+        while True:
+            with LocalReactor._timer_lock:
+                if len(LocalReactor.timers) == 0 or LocalReactor.timers[0][0] > now: return
+                callback = heapq.heappop(LocalReactor.timers)[2]
+
+            try: callback()
+            except Exception as e:
+                RNS.log(f"Error in local interface reactor timer: {e}", RNS.LOG_ERROR)
+                RNS.trace_exception(e)
+
+    @staticmethod
+    def __job():
+        with LocalReactor._job_lock:
+            if LocalReactor._job_active: return
+            LocalReactor._job_active = True
+
+        try:
+            while True:
+                with LocalReactor._timer_lock:
+                    if len(LocalReactor.timers) == 0: timeout = None
+                    else:                             timeout = max(0, LocalReactor.timers[0][0]-time.monotonic())
+
+                for key, events in LocalReactor.selector.select(timeout):
+                    read_callback, write_callback = key.data
+                    try:
+                        if events & selectors.EVENT_READ: read_callback()
+                        # The read callback may have closed the socket
+                        if events & selectors.EVENT_WRITE and write_callback != None and key.fileobj.fileno() != -1: write_callback()
+
+                    except Exception as e:
+                        RNS.log(f"Error in local interface reactor callback: {e}", RNS.LOG_ERROR)
+                        RNS.trace_exception(e)
+
+                LocalReactor.run_timers()
+
+        except Exception as e:
+            RNS.log(f"Local interface reactor error: {e}", RNS.LOG_ERROR)
+            RNS.trace_exception(e)
+
+        finally:
+            LocalReactor._job_active = False
 
 class LocalClientInterface(Interface):
     RECONNECT_WAIT = 8
+    RECONNECT_BACKOFF = 0.1
     AUTOCONFIGURE_MTU = True
     CLIENT_SLEEP_PAUSE_TIMEOUT = 12
+    FRAME_BUFFER_COMPACT = 64*1024
+    MAX_FRAME = 524288
+    READ_BUFFER_SIZE = 64*1024
+    SOCKET_BUFFER_SIZE = 1024*1024
+
+    # Peers on the same host can agree to replace HDLC with
+    # length-prefixed framing, which needs no escaping. The
+    # offer and switch markers are sent as HDLC frames shorter
+    # than any valid packet, so peers without support for the
+    # negotiation silently discard them, and keep using HDLC.
+    FRAMING_HDLC   = 0x00
+    FRAMING_LENGTH = 0x01
+    FRAMING_OFFER  = bytes([0xF0, 0x01])
+    FRAMING_SWITCH = bytes([0xF0, 0x02])
+    LENGTH_HEADER  = struct.Struct("!I")
 
     def __init__(self, owner, name, target_port = None, connected_socket=None, socket_path=None):
         super().__init__()
@@ -83,21 +281,28 @@ class LocalClientInterface(Interface):
         self.detached         = False
         self.name             = name
         self.mode             = RNS.Interfaces.Interface.Interface.MODE_FULL
-        self.frame_buffer     = b""
-        self.transmit_buffer  = b""
+        self.read_buffer      = None
+        self.tx_lock          = Lock()
+        self.send_lock        = Lock()
+        self.send_deadline    = 0
+        self.reconnect_event  = threading.Event()
+        self.reset_framing()
 
         if RNS.vendor.platformutils.use_epoll(): self.epoll_backend = True
 
+        # The read buffer is only used by the local reactor, since
+        # the epoll backend performs its own reads for the socket.
+        if not self.epoll_backend: self.read_buffer = bytearray(self.READ_BUFFER_SIZE)
+
         self.pause_on_client_sleep = False
+        self.owner = owner
 
         if connected_socket != None:
             self.receives    = True
             self.target_ip   = None
             self.target_port = None
             self.socket      = connected_socket
-
-            if self.socket.family == socket.AF_INET:
-                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.configure_socket()
 
             self.is_connected_to_shared_instance = False
 
@@ -117,7 +322,6 @@ class LocalClientInterface(Interface):
             self.target_port = target_port
             self.connect()
 
-        self.owner   = owner
         self.bitrate = 1_000_000_000
         self.online  = True
         self.writing = False
@@ -128,24 +332,75 @@ class LocalClientInterface(Interface):
         self.announce_rate_grace   = None
         self.announce_rate_penalty = None
 
-        if connected_socket == None:
-            if not self.epoll_backend:
-                thread = threading.Thread(target=self.read_loop)
-                thread.daemon = True
-                thread.start()
-
     def should_ingress_limit(self):
         return False
 
+    def configure_socket(self):
+        # Frames are always handed to the socket whole, and any
+        # frames queued up meanwhile are written out together
+        # from the transmit buffer, so there is nothing left for
+        # Nagle's algorithm or TCP_CORK to coalesce. Enabling
+        # either would only add latency.
+        if self.socket.family == socket.AF_INET:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # A larger receive buffer lets the kernel queue up more
+        # data between reads, so each read of READ_BUFFER_SIZE
+        # drains more of it in one call during bulk transfers.
+        try: self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.SOCKET_BUFFER_SIZE)
+        except Exception as e: RNS.log(f"Could not set receive buffer size for {self}: {e}", RNS.LOG_DEBUG)
+
+    def reset_framing(self):
+        # Every new connection starts out with HDLC framing in
+        # both directions, and an empty receive buffer.
+        self.frame_buffer      = bytearray()
+        self.frame_start       = -1
+        self.frame_scan        = 0
+        self.rx_framing        = self.FRAMING_HDLC
+        with self.tx_lock:
+            self.transmit_buffer   = b""
+            self.tx_waiting        = False
+            self.tx_framing        = self.FRAMING_HDLC
+            self.tx_switch_pending = False
+
+    def offer_framing(self):
+        try: self.buffer_frames([self.FRAMING_OFFER])
+        except Exception as e: RNS.log(f"Could not send framing offer on {self}: {e}", RNS.LOG_DEBUG)
+
+    def framing_offered(self):
+        # The switch is carried out by whichever thread writes
+        # the next frames, so that the marker is placed exactly
+        # between the last HDLC frame and the first new one.
+        with self.tx_lock:
+            if self.tx_framing == self.FRAMING_HDLC: self.tx_switch_pending = True
+
+    def switch_framing(self):
+        # Must be called with tx_lock held. Returns whether a
+        # switch marker must precede the next frames written.
+        if not self.tx_switch_pending: return False
+        self.tx_switch_pending = False
+        self.tx_framing = self.FRAMING_LENGTH
+        return True
+
     def connect(self):
+        self.reset_framing()
         if self.socket_path != None:
             self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            self.socket.connect(self.socket_path)
+            target = self.socket_path
         
         else:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            self.socket.connect((self.target_ip, self.target_port))
+            target = (self.target_ip, self.target_port)
+
+        # Sockets from failed attempts are closed right away, so
+        # repeated reconnect attempts do not leak descriptors.
+        try:
+            self.configure_socket()
+            self.socket.connect(target)
+
+        except Exception as e:
+            self.socket.close()
+            raise e
 
         self.online = True
         self.is_connected_to_shared_instance = True
@@ -153,6 +408,8 @@ class LocalClientInterface(Interface):
 
         if RNS.vendor.platformutils.is_android(): self.phy_keepalive = True
         if self.epoll_backend: BackboneInterface.add_client_socket(self.socket, self)
+        else:                  LocalReactor.register(self.socket, self.read_ready, self.write_ready)
+        self.offer_framing()
 
         return True
 
@@ -163,24 +420,29 @@ class LocalClientInterface(Interface):
                 self.reconnecting = True
                 attempts = 0
 
+                # The wait between attempts starts out short, so that
+                # a restarted shared instance is picked up quickly, and
+                # is doubled after each failed attempt up to the usual
+                # reconnect wait. Detaching the interface ends the wait.
+                backoff = LocalClientInterface.RECONNECT_BACKOFF
                 while not self.online:
-                    time.sleep(LocalClientInterface.RECONNECT_WAIT)
-                    attempts += 1
+                    self.reconnect_event.wait(backoff)
+                    if self.detached:
+                        self.reconnecting = False
+                        return
 
+                    attempts += 1
                     try:
                         self.connect()
 
                     except Exception as e:
                         RNS.log("Connection attempt for "+str(self)+" failed: "+str(e), RNS.LOG_DEBUG)
+                        backoff = min(backoff*2, LocalClientInterface.RECONNECT_WAIT)
 
                 if not self.never_connected:
                     RNS.log("Reconnected socket for "+str(self)+".", RNS.LOG_INFO)
 
                 self.reconnecting = False
-                if not self.epoll_backend:
-                    thread = threading.Thread(target=self.read_loop)
-                    thread.daemon = True
-                    thread.start()
 
                 def job():
                     time.sleep(LocalClientInterface.RECONNECT_WAIT+2)
@@ -195,23 +457,20 @@ class LocalClientInterface(Interface):
     def send_keepalive(self):
         if self.online:
             RNS.log(f"Sending keepalive on {self}", RNS.LOG_DEBUG) # TODO: Remove
-            try:
-                if self.epoll_backend:
-                    self.transmit_buffer += bytes([HDLC.FLAG])+bytes([HDLC.FLAG])
-                    BackboneInterface.tx_ready(self)
-
-                else:
-                    self.writing = True
-                    data = bytes([HDLC.FLAG])+HDLC.escape(data)+bytes([HDLC.FLAG])
-                    self.socket.sendall(data)
-                    self.writing = False
-
+            try: self.buffer_frames([b""])
             except Exception as e: RNS.log(f"Exception occurred while sending keepalive on {self}: {e}", RNS.LOG_ERROR)
 
     def process_incoming(self, data):
         self.rxb += len(data)
         if self.parent_interface != None: self.parent_interface.rxb += len(data)
-        
+        self.deliver_incoming(data)
+
+    def deliver_incoming(self, data):
+        # Frames are always handed on as exact-size bytes, copied
+        # out of the frame buffer once. Transport keeps the raw
+        # data of packets in its tables and caches, and the packet
+        # parser relies on bytes semantics, so views into a reused
+        # buffer can not be passed on instead.
         try: self.owner.inbound(data, self)
         except Exception as e:
             RNS.log(f"An error occurred in the processing of an incoming frame for {self}: {e}", RNS.LOG_ERROR)
@@ -224,28 +483,22 @@ class LocalClientInterface(Interface):
 
         if self.online:
             try:
-                if self.epoll_backend:
-                    self.transmit_buffer += bytes([HDLC.FLAG])+HDLC.escape(data)+bytes([HDLC.FLAG])
-                    BackboneInterface.tx_ready(self)
-
-                else:
-                    self.writing = True
-
-                    if self._force_bitrate:
-                        if not hasattr(self, "send_lock"):
-                            self.send_lock = Lock()
-
-                        with self.send_lock:
-                            # RNS.log(f"Simulating latency of {RNS.prettytime(s)} for {len(data)} bytes", RNS.LOG_EXTREME)
-                            s = len(data) / self.bitrate * 8
-                            time.sleep(s)
-
-                    data = bytes([HDLC.FLAG])+HDLC.escape(data)+bytes([HDLC.FLAG])
-                    self.socket.sendall(data)
-                    self.writing = False
-                    self.txb += len(data)
-                    if hasattr(self, "parent_interface") and self.parent_interface != None:
-                        self.parent_interface.txb += len(data)
+                if self._force_bitrate and not self.epoll_backend:
+                    # Each frame reserves its transmission time after
+                    # any frames already scheduled, and is buffered by
+                    # the local reactor once that time has come, so no
+                    # thread is held up while waiting for it.
+                    with self.send_lock:
+                        now = time.monotonic()
+                        self.send_deadline = max(now, self.send_deadline) + len(data) / self.bitrate * 8
+                        deadline = self.send_deadline
+
+                    # RNS.log(f"Simulating latency of {RNS.prettytime(deadline-now)} for {len(data)} bytes", RNS.LOG_EXTREME)
+                    def job():
+                        if self.online: self.buffer_frames([data])
+                    LocalReactor.schedule(deadline, job)
+
+                else: self.buffer_frames([data])
 
             except Exception as e:
                 RNS.log("Exception occurred while transmitting via "+str(self)+", tearing down interface", RNS.LOG_ERROR)
@@ -253,27 +506,205 @@ class LocalClientInterface(Interface):
                 RNS.trace_exception(e)
                 self.teardown()
 
+    def buffer_frames(self, frames):
+        # Frames are appended to the transmit buffer, which is
+        # written out by the epoll backend job, or by the local
+        # reactor whenever the socket can take more data.
+        with self.tx_lock:
+            buffers, written = self.encode_frames(frames, self.switch_framing())
+            self.transmit_buffer += b"".join(buffers)
+
+        if self.epoll_backend: BackboneInterface.tx_ready(self)
+        else:                  self.write_ready()
+
+    def write_ready(self):
+        # Writes as much of the transmit buffer as the socket
+        # takes without blocking. This is tried right away when
+        # frames are buffered, and the local reactor picks up
+        # whatever is left once the socket is writable again.
+        failed = False
+        with self.tx_lock:
+            sock = self.socket
+            if sock == None: return
+
+            if len(self.transmit_buffer) > 0:
+                try: written = sock.send(self.transmit_buffer)
+                except (BlockingIOError, InterruptedError): written = 0
+                except Exception as e:
+                    RNS.log(f"Error while writing to {self}: {e}", RNS.LOG_DEBUG)
+                    self.transmit_buffer = b""
+                    written = 0
+                    failed  = True
+
+                if written > 0:
+                    self.transmit_buffer = self.transmit_buffer[written:]
+                    self.txb += written
+                    if self.parent_interface != None: self.parent_interface.txb += written
+
+            waiting = len(self.transmit_buffer) > 0
+            if waiting != self.tx_waiting:
+                self.tx_waiting = waiting
+                LocalReactor.set_writable(sock, waiting)
+
+        # The connection is closed by the read side, which then
+        # handles it like any other closed connection.
+        if failed:
+            try: sock.shutdown(socket.SHUT_RDWR)
+            except Exception as e: RNS.log(f"Error while shutting down socket for {self}: {e}", RNS.LOG_DEBUG)
+
+    def encode_frames(self, frames, switch):
+        flag    = HDLC.FLAG_BYTES
+        buffers = []
+        written = 0
+        if switch:
+            buffers.extend((flag, self.FRAMING_SWITCH, flag))
+            written += len(self.FRAMING_SWITCH)+2
+
+        if self.tx_framing == self.FRAMING_LENGTH:
+            # Payloads are passed on as they are, preceded only
+            # by their length, without any escaping or copying.
+            pack = self.LENGTH_HEADER.pack
+            for data in frames:
+                written += len(data)+self.LENGTH_HEADER.size
+                buffers.extend((pack(len(data)), data))
+
+        else:
+            escape = HDLC.escape
+            for data in frames:
+                escaped  = escape(data)
+                written += len(escaped)+2
+                buffers.extend((flag, escaped, flag))
+
+        return buffers, written
+
     def handle_hdlc(self, data_in):
-        self.frame_buffer += data_in
-        flags_remaining = True
-        while flags_remaining:
-            frame_start = self.frame_buffer.find(HDLC.FLAG)
+        # Frames are consumed by advancing cursors into the
+        # persistent buffer. The scan position is kept across
+        # calls, so every received byte is only searched once,
+        # and the processed head of the buffer is discarded
+        # once it grows large.
+        frame_buffer = self.frame_buffer
+        frame_buffer.extend(data_in)
+        frame_start = self.frame_start
+        frame_scan  = self.frame_scan
+        find        = frame_buffer.find
+        unescape    = HDLC.unescape
+        deliver     = self.deliver_incoming
+        FLAG        = HDLC.FLAG
+        MINSIZE     = RNS.Reticulum.HEADER_MINSIZE
+        received    = 0
+        switched    = False
+        while True:
+            flag = find(FLAG, frame_scan)
+            if flag == -1:
+                frame_scan = len(frame_buffer)
+                break
+
             if frame_start != -1:
-                frame_end = self.frame_buffer.find(HDLC.FLAG, frame_start+1)
-                if frame_end != -1:
-                    frame = self.frame_buffer[frame_start+1:frame_end]
-                    frame = frame.replace(bytes([HDLC.ESC, HDLC.FLAG ^ HDLC.ESC_MASK]), bytes([HDLC.FLAG]))
-                    frame = frame.replace(bytes([HDLC.ESC, HDLC.ESC  ^ HDLC.ESC_MASK]), bytes([HDLC.ESC]))
-                    if len(frame) > RNS.Reticulum.HEADER_MINSIZE: self.process_incoming(frame)
-                    self.frame_buffer = self.frame_buffer[frame_end:]
-                
-                else: flags_remaining = False
-            
-            else: flags_remaining = False
+                frame = unescape(frame_buffer, frame_start+1, flag)
+                if len(frame) > MINSIZE:
+                    received += len(frame)
+                    deliver(frame)
+
+                elif frame == self.FRAMING_OFFER: self.framing_offered()
+                elif frame == self.FRAMING_SWITCH:
+                    # Everything following the switch marker is
+                    # length-prefixed, and parsed as such below.
+                    self.rx_framing = self.FRAMING_LENGTH
+                    frame_start = -1
+                    frame_scan  = flag+1
+                    switched    = True
+                    break
+
+            # The closing flag of a frame also opens the next one
+            frame_start = flag
+            frame_scan  = flag+1
+
+        # An escaped frame can be at most twice MAX_FRAME, the
+        # largest hardware MTU any interface is configured with.
+        # The local HW_MTU is not used here, since it is unset for
+        # low simulated bitrates, and may differ from the peer's.
+        # If an open frame grows beyond that, the peer is broken
+        # or malicious, and the buffer is dropped to resynchronise
+        # on the next flag, instead of growing without bound.
+        if frame_start != -1 and len(frame_buffer)-frame_start > 2*self.MAX_FRAME:
+            RNS.log(f"Oversized frame received on {self}, discarding {RNS.prettysize(len(frame_buffer)-frame_start)} of buffered data", RNS.LOG_WARNING)
+            frame_buffer.clear()
+            frame_start = -1
+            frame_scan  = 0
+
+        consumed = frame_start if frame_start != -1 else frame_scan
+        if consumed > self.FRAME_BUFFER_COMPACT:
+            del frame_buffer[:consumed]
+            frame_scan -= consumed
+            if frame_start != -1: frame_start -= consumed
+
+        self.frame_start = frame_start
+        self.frame_scan  = frame_scan
+
+        # Byte counters are updated once for all frames
+        # delivered from this read, instead of per frame
+        if received > 0:
+            self.rxb += received
+            if self.parent_interface != None: self.parent_interface.rxb += received
+
+        if switched: self.handle_length_prefixed(b"")
+
+    def handle_length_prefixed(self, data_in):
+        frame_buffer = self.frame_buffer
+        frame_buffer.extend(data_in)
+        frame_scan  = self.frame_scan
+        unpack_from = self.LENGTH_HEADER.unpack_from
+        header_size = self.LENGTH_HEADER.size
+        deliver     = self.deliver_incoming
+        MINSIZE     = RNS.Reticulum.HEADER_MINSIZE
+        received    = 0
+        invalid     = False
+        with memoryview(frame_buffer) as buffer_view:
+            while len(frame_buffer)-frame_scan >= header_size:
+                length = unpack_from(frame_buffer, frame_scan)[0]
+                if length > self.MAX_FRAME:
+                    invalid = True
+                    break
+
+                start = frame_scan+header_size
+                end   = start+length
+                if end > len(frame_buffer): break
+
+                frame_scan = end
+                if length > MINSIZE:
+                    frame = bytes(buffer_view[start:end])
+                    received += length
+                    deliver(frame)
+
+                elif buffer_view[start:end] == self.FRAMING_OFFER: self.framing_offered()
+
+        if invalid:
+            # Without flags to resynchronise on, a corrupt length
+            # leaves the stream unusable, so the connection is shut
+            # down and handled like any other closed connection.
+            RNS.log(f"Invalid frame length received on {self}, closing connection", RNS.LOG_ERROR)
+            frame_buffer.clear()
+            self.frame_scan = 0
+            try: self.socket.shutdown(socket.SHUT_RDWR)
+            except Exception as e: RNS.log(f"Error while shutting down socket for {self}: {e}", RNS.LOG_DEBUG)
+            return
+
+        if frame_scan > self.FRAME_BUFFER_COMPACT:
+            del frame_buffer[:frame_scan]
+            frame_scan = 0
+
+        self.frame_scan = frame_scan
+
+        if received > 0:
+            self.rxb += received
+            if self.parent_interface != None: self.parent_interface.rxb += received
 
     def receive(self, data_in):
         try:
-            if len(data_in) > 0: self.handle_hdlc(data_in)
+            if len(data_in) > 0:
+                if self.rx_framing == self.FRAMING_LENGTH: self.handle_length_prefixed(data_in)
+                else:                                      self.handle_hdlc(data_in)
             else:
                 self.online = False
                 if self.is_connected_to_shared_instance and not self.detached:
@@ -294,32 +725,24 @@ class LocalClientInterface(Interface):
 
         if self.pause_on_client_sleep: self.pause_timeout = time.time() + self.CLIENT_SLEEP_PAUSE_TIMEOUT
 
-    def read_loop(self):
-        try:
-            self.frame_buffer = b""
-            data_in = b""
-            while True:
-                data_in = self.socket.recv(4096)
-                if len(data_in) > 0: self.handle_hdlc(data_in)
-                else:
-                    self.online = False
-                    if self.is_connected_to_shared_instance and not self.detached:
-                        RNS.log("Socket for "+str(self)+" was closed, attempting to reconnect...", RNS.LOG_WARNING)
-                        RNS.Transport.shared_connection_disappeared()
-                        # TODO: Potentially run this in a thread, but since if we get here,
-                        # there's no other connectivity left to block anyway, it might be
-                        # unnecessary.
-                        self.reconnect()
-                    else:
-                        self.teardown(nowarning=True)
+    def read_ready(self):
+        # Called from the local reactor when the socket is
+        # readable. Errors and closed sockets are passed on
+        # to receive, just like with the epoll backend.
+        try: read_bytes = self.socket.recv_into(self.read_buffer)
+        except (BlockingIOError, InterruptedError): return
+        except Exception as e:
+            RNS.log(f"Error while reading from {self}: {e}", RNS.LOG_DEBUG)
+            read_bytes = 0
 
-                    break
+        if read_bytes == 0:
+            # Writers check the socket under the transmit lock
+            with self.tx_lock:
+                LocalReactor.deregister(self.socket)
+                try: self.socket.close()
+                except Exception as e: RNS.log(f"Error while closing socket for {self}: {e}", RNS.LOG_DEBUG)
 
-        except Exception as e:
-            self.online = False
-            RNS.log("An interface error occurred, the contained exception was: "+str(e), RNS.LOG_ERROR)
-            RNS.log("Tearing down "+str(self), RNS.LOG_ERROR)
-            self.teardown()
+        with memoryview(self.read_buffer) as read_view: self.receive(read_view[:read_bytes])
 
     def detach(self):
         if self.socket != None:
@@ -327,7 +750,10 @@ class LocalClientInterface(Interface):
                 if callable(self.socket.close):
                     RNS.log("Detaching "+str(self), RNS.LOG_DEBUG)
                     self.detached = True
+                    self.reconnect_event.set()
                     
+                    if not self.epoll_backend: LocalReactor.deregister(self.socket)
+
                     try:
                         if self.socket != None:
                             self.socket.shutdown(socket.SHUT_RDWR)
@@ -351,7 +777,7 @@ class LocalClientInterface(Interface):
 
         if self in RNS.Transport.local_client_interfaces:
             RNS.Transport.local_client_interfaces.remove(self)
-            if hasattr(self, "parent_interface") and self.parent_interface != None:
+            if self.parent_interface != None:
                 self.parent_interface.clients -= 1
                 if hasattr(RNS.Transport, "owner") and RNS.Transport.owner != None:
                     background = not self.detached
@@ -382,6 +808,8 @@ class LocalServerInterface(Interface):
         self.epoll_backend = False
         self.online = False
         self.clients = 0
+        self._force_bitrate = False
+        self.server_socket = None
         
         if socket_path != None and RNS.Reticulum.get_instance().use_af_unix: self.socket_path = f"\0rns/{socket_path}"
         else: self.socket_path = None
@@ -413,17 +841,7 @@ class LocalServerInterface(Interface):
 
             address = (self.bind_ip, self.bind_port)
             if self.epoll_backend: BackboneInterface.add_listener(self, address)
-            else:
-                def handlerFactory(callback):
-                    def createHandler(*args, **keys):
-                        return LocalInterfaceHandler(callback, *args, **keys)
-                    return createHandler
-
-                self.server = ThreadingTCPServer(address, handlerFactory(self.incoming_connection))
-                self.server.daemon_threads = True
-                thread = threading.Thread(target=self.server.serve_forever)
-                thread.daemon = True
-                thread.start()
+            else:                  self.server_socket = LocalReactor.add_listener(self, address)
 
         self.announce_rate_target  = None
         self.announce_rate_grace   = None
@@ -433,54 +851,48 @@ class LocalServerInterface(Interface):
         self.online = True
 
     def incoming_connection(self, handler):
-        if self.epoll_backend:
-            client_socket = handler
-            if client_socket.family == socket.AF_INET:
-                interface_name = str(str(client_socket.getpeername()[1]))
-            elif client_socket.family == socket.AF_UNIX:
-                interface_name = f"{self.clients}@{self.socket_path}"
-
-            spawned_interface = LocalClientInterface(self.owner, name=interface_name, connected_socket=client_socket)
-            spawned_interface.OUT = self.OUT
-            spawned_interface.IN  = self.IN
-            spawned_interface.socket = client_socket
-            spawned_interface.parent_interface = self
-            spawned_interface.bitrate = self.bitrate
-
-            if client_socket.family == socket.AF_INET:
-                spawned_interface.target_ip = client_socket.getpeername()[0]
-                spawned_interface.target_port = str(client_socket.getpeername()[1])
-
-            elif client_socket.family == socket.AF_UNIX:
-                spawned_interface.target_ip = None
-                spawned_interface.target_port = interface_name
-                spawned_interface.socket_path = self.socket_path
-
-            if hasattr(self, "_force_bitrate"): spawned_interface._force_bitrate = self._force_bitrate
-            RNS.Transport.add_interface(spawned_interface)
-            RNS.Transport.local_client_interfaces.append(spawned_interface)
-            BackboneInterface.add_client_socket(client_socket, spawned_interface)
-            self.clients += 1
-            return True
-
-        else:
-            interface_name = str(str(handler.client_address[1]))
-            spawned_interface = LocalClientInterface(self.owner, name=interface_name, connected_socket=handler.request)
-            spawned_interface.OUT = self.OUT
-            spawned_interface.IN  = self.IN
-            spawned_interface.target_ip = handler.client_address[0]
-            spawned_interface.target_port = str(handler.client_address[1])
-            spawned_interface.parent_interface = self
-            spawned_interface.bitrate = self.bitrate
-            if hasattr(self, "_force_bitrate"): spawned_interface._force_bitrate = self._force_bitrate
-            RNS.Transport.add_interface(spawned_interface)
-            RNS.Transport.local_client_interfaces.append(spawned_interface)
-            self.clients += 1
-            spawned_interface.read_loop()
+        client_socket = handler
+        if client_socket.family == socket.AF_INET:
+            interface_name = str(str(client_socket.getpeername()[1]))
+        elif client_socket.family == socket.AF_UNIX:
+            interface_name = f"{self.clients}@{self.socket_path}"
+
+        spawned_interface = LocalClientInterface(self.owner, name=interface_name, connected_socket=client_socket)
+        spawned_interface.OUT = self.OUT
+        spawned_interface.IN  = self.IN
+        spawned_interface.socket = client_socket
+        spawned_interface.parent_interface = self
+        spawned_interface.bitrate = self.bitrate
+
+        if client_socket.family == socket.AF_INET:
+            spawned_interface.target_ip = client_socket.getpeername()[0]
+            spawned_interface.target_port = str(client_socket.getpeername()[1])
+
+        elif client_socket.family == socket.AF_UNIX:
+            spawned_interface.target_ip = None
+            spawned_interface.target_port = interface_name
+            spawned_interface.socket_path = self.socket_path
+
+        spawned_interface._force_bitrate = self._force_bitrate
+        RNS.Transport.add_interface(spawned_interface)
+        RNS.Transport.local_client_interfaces.append(spawned_interface)
+        if self.epoll_backend: BackboneInterface.add_client_socket(client_socket, spawned_interface)
+        else:                  LocalReactor.register(client_socket, spawned_interface.read_ready, spawned_interface.write_ready)
+        spawned_interface.offer_framing()
+        self.clients += 1
+        return True
 
     def process_outgoing(self, data):
         pass
 
+    def detach(self):
+        if self.server_socket != None:
+            RNS.log("Detaching "+str(self), RNS.LOG_DEBUG)
+            LocalReactor.deregister(self.server_socket)
+            try: self.server_socket.close()
+            except Exception as e: RNS.log("Error while closing socket for "+str(self)+": "+str(e))
+            self.server_socket = None
+
     def received_announce(self, from_spawned=False):
         if from_spawned: self.ia_freq_deque.append(time.time())
 
@@ -496,11 +908,3 @@ class LocalServerInterface(Interface):
     def __str__(self):
         if self.socket_path: return "Shared Instance["+str(self.socket_path.replace("\0", ""))+"]"
         else: return "Shared Instance["+str(self.bind_port)+"]"
-
-class LocalInterfaceHandler(socketserver.BaseRequestHandler):
-    def __init__(self, callback, *args, **keys):
-        self.callback = callback
-        socketserver.BaseRequestHandler.__init__(self, *args, **keys)
-
-    def handle(self):
-        self.callback(handler=self)
\ No newline at end of file
@@ -5,6 +5,8 @@ from .hashes import TestSHA512
 from .identity import TestIdentity
 from .link import TestLink
 from .channel import TestChannel
+from .localinterface import TestLocalInterfaceFraming
+from .localinterface import TestLocalReactor
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file
@@ -0,0 +1,407 @@
+import unittest
+from unittest import mock
+
+import threading
+import socket
+import struct
+import random
+import time
+import RNS
+import RNS.vendor.platformutils
+from RNS.Interfaces.BackboneInterface import BackboneInterface
+from RNS.Interfaces.LocalInterface import LocalClientInterface, LocalServerInterface, LocalReactor, HDLC
+
+FLAG = HDLC.FLAG_BYTES
+
+class Instance:
+    use_af_unix = False
+    def __getattr__(self, name): return lambda *args, **kwargs: 0
+
+class Owner:
+    def __init__(self): self.frames = []
+    def inbound(self, data, interface): self.frames.append(data)
+
+def payloads(count, seed=0):
+    rng = random.Random(seed)
+    frames = []
+    for i in range(count):
+        # Every third payload is dense with flag and escape bytes
+        if i % 3 == 0: frames.append(bytes(rng.choice([HDLC.FLAG, HDLC.ESC, 0x5D, 0x5E, 0x01]) for _ in range(rng.randint(20, 400))))
+        else:          frames.append(bytes(rng.getrandbits(8) for _ in range(rng.randint(20, 3000))))
+    return frames
+
+def hdlc_stream(frames):
+    return b"".join(FLAG+HDLC.escape(frame)+FLAG for frame in frames)
+
+def length_stream(frames):
+    return b"".join(struct.pack("!I", len(frame))+frame for frame in frames)
+
+def offered(interface):
+    # A side switches as soon as it writes after receiving the
+    # offer, and that write may already be its own offer.
+    return interface.tx_switch_pending or interface.tx_framing == LocalClientInterface.FRAMING_LENGTH
+
+def wait_for(condition, timeout=5):
+    deadline = time.time()+timeout
+    while not condition():
+        if time.time() > deadline: return False
+        time.sleep(0.01)
+    return True
+
+class LocalInterfaceTestCase(unittest.TestCase):
+    epoll = False
+
+    def setUp(self):
+        patches = [mock.patch.object(RNS.Reticulum, "get_instance", return_value=Instance()),
+                   mock.patch.object(RNS.vendor.platformutils, "use_epoll", return_value=self.epoll),
+                   mock.patch.object(RNS.Transport, "add_interface"),
+                   mock.patch.object(RNS.Transport, "remove_interface"),
+                   mock.patch.object(RNS.Transport, "local_client_interfaces", []),
+                   mock.patch.object(RNS.Transport, "owner", None, create=True)]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        # Registered after the patches, so the sockets are closed
+        # before those are undone, but after any interface using
+        # them has been detached from the reactor.
+        self.sockets = []
+        self.addCleanup(self.close_sockets)
+
+    def close_sockets(self):
+        for sock in self.sockets:
+            try: sock.close()
+            except Exception: pass
+
+    def interface(self, sock):
+        owner = Owner()
+        interface = LocalClientInterface(owner, "test", connected_socket=sock)
+        return interface, owner
+
+    def reader(self, interface):
+        # Feeds everything read from the socket to the interface,
+        # like the epoll backend does, including the final EOF.
+        def job():
+            while True:
+                try: data = interface.socket.recv(4096)
+                except OSError: data = b""
+                interface.receive(data)
+                if len(data) == 0: break
+
+        threading.Thread(target=job, daemon=True).start()
+
+    def register(self, interface):
+        LocalReactor.register(interface.socket, interface.read_ready, interface.write_ready)
+        self.addCleanup(interface.detach)
+
+    def start(self, interface):
+        # Without epoll, the local reactor both reads and writes
+        if interface.epoll_backend: self.reader(interface)
+        else:                       self.register(interface)
+
+    def socketpair(self):
+        pair = socket.socketpair()
+        self.sockets.extend(pair)
+        return pair
+
+    def pair(self):
+        a, b = self.socketpair()
+        first, first_owner   = self.interface(a)
+        second, second_owner = self.interface(b)
+        return first, first_owner, second, second_owner
+
+class TestLocalInterfaceFraming(LocalInterfaceTestCase):
+    def test_escape_roundtrip(self):
+        for frame in payloads(30):
+            escaped = HDLC.escape(frame)
+            self.assertEqual(escaped.count(HDLC.FLAG), 0)
+            self.assertEqual(HDLC.unescape(escaped), frame)
+
+    def test_split_reads(self):
+        interface, owner = self.interface(self.socketpair()[0])
+        frames = payloads(150)
+        stream = hdlc_stream(frames)
+        rng = random.Random(1)
+        position = 0
+        while position < len(stream):
+            size = rng.randint(1, 5000)
+            interface.receive(stream[position:position+size])
+            position += size
+
+        self.assertEqual(owner.frames, frames)
+        self.assertEqual(interface.rxb, sum(len(frame) for frame in frames))
+
+    def test_oversized_frame_discarded(self):
+        interface, owner = self.interface(self.socketpair()[0])
+
+        # Low forced bitrates leave the hardware MTU unset
+        interface.HW_MTU = None
+        interface.receive(FLAG)
+        for i in range(20): interface.receive(b"\x01"*64*1024)
+        self.assertLess(len(interface.frame_buffer), 2*LocalClientInterface.MAX_FRAME+64*1024)
+
+        frames = payloads(5)
+        interface.receive(hdlc_stream(frames))
+        self.assertEqual(owner.frames, frames)
+        self.assertTrue(interface.online)
+
+    def test_switch_in_split_reads(self):
+        interface, owner = self.interface(self.socketpair()[0])
+        before = payloads(20, seed=2)
+        after  = payloads(20, seed=3)
+        stream  = hdlc_stream(before)
+        stream += FLAG+LocalClientInterface.FRAMING_OFFER+FLAG
+        stream += FLAG+LocalClientInterface.FRAMING_SWITCH+FLAG
+        stream += length_stream(after)+struct.pack("!I", 0)
+
+        rng = random.Random(4)
+        position = 0
+        while position < len(stream):
+            size = rng.randint(1, 3000)
+            interface.receive(stream[position:position+size])
+            position += size
+
+        self.assertEqual(owner.frames, before+after)
+        self.assertEqual(interface.rx_framing, LocalClientInterface.FRAMING_LENGTH)
+        self.assertTrue(interface.tx_switch_pending)
+
+    def handshake(self, epoll):
+        first, first_owner, second, second_owner = self.pair()
+        frames = payloads(60)
+        for interface in (first, second):
+            interface.epoll_backend = epoll
+            self.start(interface)
+
+        # With the epoll backend, the transmit buffer is written
+        # out by the backend job, which is stood in for here.
+        def tx_ready(interface):
+            with interface.tx_lock:
+                interface.socket.sendall(interface.transmit_buffer)
+                interface.transmit_buffer = b""
+
+        with mock.patch.object(BackboneInterface, "tx_ready", side_effect=tx_ready):
+            first.process_outgoing(frames[0])
+            second.process_outgoing(frames[0])
+            first.offer_framing()
+            second.offer_framing()
+            self.assertTrue(wait_for(lambda: offered(first) and offered(second)))
+
+            for frame in frames[1:]:
+                first.process_outgoing(frame)
+                second.process_outgoing(frame)
+
+            first.send_keepalive()
+            second.send_keepalive()
+            self.assertTrue(wait_for(lambda: len(first_owner.frames) == len(frames) and len(second_owner.frames) == len(frames)))
+
+        self.assertEqual(first_owner.frames, frames)
+        self.assertEqual(second_owner.frames, frames)
+        for interface in (first, second):
+            self.assertEqual(interface.tx_framing, LocalClientInterface.FRAMING_LENGTH)
+            self.assertEqual(interface.rx_framing, LocalClientInterface.FRAMING_LENGTH)
+
+    def test_handshake(self):
+        self.handshake(epoll=False)
+
+    def test_handshake_epoll(self):
+        self.handshake(epoll=True)
+
+    def test_legacy_peer(self):
+        local, peer = self.socketpair()
+        interface, owner = self.interface(local)
+        self.start(interface)
+        frames = payloads(30)
+
+        # A peer without support for the negotiation discards the
+        # offer, and never sends one, so HDLC is kept both ways.
+        interface.offer_framing()
+        for frame in frames: interface.process_outgoing(frame)
+        peer.sendall(hdlc_stream(frames))
+        self.assertTrue(wait_for(lambda: len(owner.frames) == len(frames)))
+
+        received = b""
+        expected = len(hdlc_stream(frames))+len(FLAG+HDLC.escape(LocalClientInterface.FRAMING_OFFER)+FLAG)
+        while len(received) < expected: received += peer.recv(65536)
+
+        delivered = [HDLC.unescape(frame) for frame in received.split(FLAG) if len(frame) > RNS.Reticulum.HEADER_MINSIZE]
+        self.assertEqual(delivered, frames)
+        self.assertEqual(owner.frames, frames)
+        self.assertEqual(interface.tx_framing, LocalClientInterface.FRAMING_HDLC)
+        self.assertEqual(interface.rx_framing, LocalClientInterface.FRAMING_HDLC)
+
+    def test_invalid_length_closes_connection(self):
+        first, first_owner, second, second_owner = self.pair()
+        for interface in (first, second): self.start(interface)
+        first.offer_framing()
+        second.offer_framing()
+        self.assertTrue(wait_for(lambda: offered(first)))
+
+        frame = payloads(1)[0]
+        first.process_outgoing(frame)
+        self.assertTrue(wait_for(lambda: second_owner.frames == [frame]))
+
+        first.socket.sendall(struct.pack("!I", LocalClientInterface.MAX_FRAME+1))
+        self.assertTrue(wait_for(lambda: not second.online and not first.online))
+
+class TestLocalReactor(LocalInterfaceTestCase):
+    # The local reactor is the only read path on platforms without
+    # epoll, so these tests run with the epoll backend disabled.
+    epoll = False
+
+    def test_roundtrip(self):
+        first, first_owner, second, second_owner = self.pair()
+        self.assertFalse(first.epoll_backend)
+        for interface in (first, second): self.register(interface)
+
+        frames = payloads(60)
+        first.offer_framing()
+        second.offer_framing()
+        self.assertTrue(wait_for(lambda: offered(first) and offered(second)))
+        for frame in frames:
+            first.process_outgoing(frame)
+            second.process_outgoing(frame)
+
+        self.assertTrue(wait_for(lambda: len(first_owner.frames) == len(frames) and len(second_owner.frames) == len(frames)))
+        self.assertEqual(first_owner.frames, frames)
+        self.assertEqual(second_owner.frames, frames)
+        self.assertEqual(first.rx_framing, LocalClientInterface.FRAMING_LENGTH)
+        self.assertEqual(second.rx_framing, LocalClientInterface.FRAMING_LENGTH)
+
+    def test_stalled_reader(self):
+        local, peer = self.socketpair()
+        interface, owner = self.interface(local)
+        self.register(interface)
+
+        # Writing to a peer that does not read must not block the
+        # writer, or the reactor thread, and the buffered data is
+        # written out once the peer starts reading again.
+        frames  = [bytes([i])*200*1024 for i in range(1, 21)]
+        started = time.time()
+        for frame in frames: interface.process_outgoing(frame)
+        self.assertLess(time.time()-started, 2)
+        self.assertGreater(len(interface.transmit_buffer), 0)
+
+        first, first_owner, second, second_owner = self.pair()
+        for other in (first, second): self.register(other)
+        first.process_outgoing(frames[0])
+        self.assertTrue(wait_for(lambda: second_owner.frames == [frames[0]]))
+
+        received = bytearray()
+        expected = len(hdlc_stream(frames))
+        peer.settimeout(5)
+        while len(received) < expected: received += peer.recv(1024*1024)
+        self.assertEqual(bytes(received), hdlc_stream(frames))
+        self.assertTrue(wait_for(lambda: not interface.tx_waiting))
+        self.assertEqual(interface.txb, expected)
+
+    def test_forced_bitrate(self):
+        local, peer = self.socketpair()
+        interface, owner = self.interface(local)
+        self.register(interface)
+        interface._force_bitrate = True
+        interface.bitrate = 8*100*1000
+
+        # Frames are paced by reactor timers instead of sleeping
+        frames  = payloads(10)
+        started = time.time()
+        for frame in frames: interface.process_outgoing(frame)
+        self.assertLess(time.time()-started, 0.5)
+
+        received = bytearray()
+        expected = len(hdlc_stream(frames))
+        peer.settimeout(5)
+        while len(received) < expected: received += peer.recv(65536)
+        self.assertEqual(bytes(received), hdlc_stream(frames))
+        self.assertGreaterEqual(time.time()-started, sum(len(frame) for frame in frames)/100/1000*0.9)
+
+    def test_closed_connection(self):
+        local, peer = self.socketpair()
+        interface, owner = self.interface(local)
+        self.register(interface)
+
+        frames = payloads(10)
+        peer.sendall(hdlc_stream(frames))
+        peer.close()
+        self.assertTrue(wait_for(lambda: not interface.online))
+        self.assertEqual(owner.frames, frames)
+
+    def test_listener(self):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        server_owner = Owner()
+        server = LocalServerInterface(server_owner, bindport=port)
+        self.addCleanup(server.detach)
+
+        # A second instance must fail to bind, since that is how
+        # an already running shared instance is detected.
+        with self.assertRaises(OSError): LocalServerInterface(Owner(), bindport=port)
+
+        client_owner = Owner()
+        client = LocalClientInterface(client_owner, "client", target_port=port)
+        self.addCleanup(client.detach)
+        self.assertTrue(wait_for(lambda: server.clients == 1))
+        spawned = RNS.Transport.local_client_interfaces[0]
+        self.assertIs(spawned.parent_interface, server)
+
+        frames = payloads(30)
+        for frame in frames:
+            client.process_outgoing(frame)
+            spawned.process_outgoing(frame)
+
+        self.assertTrue(wait_for(lambda: len(server_owner.frames) == len(frames) and len(client_owner.frames) == len(frames)))
+        self.assertEqual(server_owner.frames, frames)
+        self.assertEqual(client_owner.frames, frames)
+        self.assertEqual(client.rx_framing, LocalClientInterface.FRAMING_LENGTH)
+        self.assertEqual(spawned.rx_framing, LocalClientInterface.FRAMING_LENGTH)
+
+        client.detach()
+        self.assertTrue(wait_for(lambda: server.clients == 0))
+        self.assertFalse(spawned.online)
+
+        # Detaching the server closes the listening socket, and
+        # releases the port for a new instance.
+        server.detach()
+        LocalServerInterface(Owner(), bindport=port).detach()
+
+    def test_accept_with_stalled_client(self):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        # Everything received by the server is forwarded to the
+        # first client, which never reads any of it.
+        class Forwarder(Owner):
+            def inbound(self, data, interface):
+                super().inbound(data, interface)
+                RNS.Transport.local_client_interfaces[0].process_outgoing(data)
+
+        server_owner = Forwarder()
+        server = LocalServerInterface(server_owner, bindport=port)
+        self.addCleanup(server.detach)
+
+        def connect():
+            client = socket.create_connection(("127.0.0.1", port))
+            self.sockets.append(client)
+            return client
+
+        stalled = connect()
+        self.assertTrue(wait_for(lambda: server.clients == 1))
+        sender = connect()
+        self.assertTrue(wait_for(lambda: server.clients == 2))
+        for spawned in RNS.Transport.local_client_interfaces: self.addCleanup(spawned.detach)
+
+        frames = [bytes([i])*200*1024 for i in range(1, 21)]
+        sender.sendall(hdlc_stream(frames))
+        self.assertTrue(wait_for(lambda: len(server_owner.frames) == len(frames)))
+
+        connect()
+        self.assertTrue(wait_for(lambda: server.clients == 3))
+        for spawned in RNS.Transport.local_client_interfaces[2:]: self.addCleanup(spawned.detach)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)